@@ -1,19 +1,20 @@
+import contextlib
 import functools
+import hashlib
 import os
 import sys
-
-from lockfile import LockTimeout
-from lockfile.pidlockfile import PIDLockFile
+import tempfile
 
 import getpass
 import click
 
-from bugwarrior.config import get_keyring, get_config_path, load_config
-from bugwarrior.collect import aggregate_issues, get_service
-from bugwarrior.db import (
-    get_defined_udas_as_strings,
-    synchronize,
-)
+try:
+    import fcntl
+except ImportError:  # Not POSIX, e.g. Windows.
+    fcntl = None
+
+from bugwarrior.config import (
+    get_cache_path, get_config_path, get_keyring, load_config)
 
 import logging
 log = logging.getLogger(__name__)
@@ -44,6 +45,49 @@ def _try_load_config(main_section, interactive=False, quiet=False):
         sys.exit(1)
 
 
+@contextlib.contextmanager
+def _pull_lock(lockfile_path):
+    """ Hold the lock on the taskrc repository, or exit if another bugwarrior
+    process holds it. """
+    if fcntl is None:
+        from lockfile import LockTimeout
+        from lockfile.pidlockfile import PIDLockFile
+
+        lockfile = PIDLockFile(lockfile_path)
+        try:
+            lockfile.acquire(timeout=10)
+        except LockTimeout:
+            log.critical(
+                'Your taskrc repository is currently locked. '
+                'Remove the file at %s if you are sure no other '
+                'bugwarrior processes are currently running.' % (
+                    lockfile_path
+                )
+            )
+            sys.exit(1)
+        try:
+            yield
+        finally:
+            lockfile.release()
+        return
+
+    lockfile = os.open(lockfile_path, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.critical(
+                'Your taskrc repository is currently locked by another '
+                'bugwarrior process (see the pid in %s).' % lockfile_path)
+            sys.exit(1)
+        os.ftruncate(lockfile, 0)
+        os.write(lockfile, b'%i\n' % os.getpid())
+        yield
+    finally:
+        # Closing the file releases the lock.
+        os.close(lockfile)
+
+
 def _legacy_cli_deprecation_warning(subcommand_callback):
     @functools.wraps(subcommand_callback)
     @click.pass_context
@@ -92,6 +136,8 @@ def pull(dry_run, flavor, interactive, debug, quiet):
 
     Relies on configuration in bugwarriorrc
     """
+    from bugwarrior.collect import aggregate_issues
+    from bugwarrior.db import synchronize
 
     try:
         main_section = _get_section_name(flavor)
@@ -99,25 +145,12 @@ def pull(dry_run, flavor, interactive, debug, quiet):
 
         lockfile_path = os.path.join(
             config[main_section].data.path, 'bugwarrior.lockfile')
-        lockfile = PIDLockFile(lockfile_path)
-        lockfile.acquire(timeout=10)
-        try:
+        with _pull_lock(lockfile_path):
             # Get all the issues.  This can take a while.
             issue_generator = aggregate_issues(config, main_section, debug)
 
             # Stuff them in the taskwarrior db as necessary
             synchronize(issue_generator, config, main_section, dry_run)
-        finally:
-            lockfile.release()
-    except LockTimeout:
-        log.critical(
-            'Your taskrc repository is currently locked. '
-            'Remove the file at %s if you are sure no other '
-            'bugwarrior processes are currently running.' % (
-                lockfile_path
-            )
-        )
-        sys.exit(1)
     except RuntimeError as e:
         log.exception("Aborted (%s)" % e)
         sys.exit(1)
@@ -135,13 +168,15 @@ def vault():
 
 
 def targets():
+    from bugwarrior.collect import get_service
+
     config = _try_load_config('general')
     for target in config['general'].targets:
-        service_class = get_service(config[target].service)
-        for value in [v for v in dict(config[target]).values()
-                      if isinstance(v, str)]:
-            if '@oracle:use_keyring' in value:
-                yield service_class.get_keyring_service(config[target])
+        service_config = config[target]
+        if any(isinstance(value, str) and '@oracle:use_keyring' in value
+               for _, value in service_config):
+            service_class = get_service(service_config.service)
+            yield service_class.get_keyring_service(service_config)
 
 
 @vault.command()
@@ -209,13 +244,53 @@ def uda(flavor):
        in filter expressions.
     """
     main_section = _get_section_name(flavor)
-    conf = _try_load_config(main_section)
+    cache_path = _get_uda_cache_path(main_section)
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            udas = f.read()
+    else:
+        from bugwarrior.db import get_defined_udas_as_strings
+        conf = _try_load_config(main_section)
+        udas = ''.join(
+            uda + '\n' for uda in get_defined_udas_as_strings(conf, main_section))
+        if cache_path:
+            _write_uda_cache(cache_path, udas)
     print("# Bugwarrior UDAs")
-    for uda in get_defined_udas_as_strings(conf, main_section):
-        print(uda)
+    print(udas, end='')
     print("# END Bugwarrior UDAs")
 
 
+def _get_uda_cache_path(main_section):
+    """ Return the path at which the udas for the current configuration file
+    are cached, or None if the configuration file cannot be read.
+
+    The udas are defined by the service classes, so the cache is keyed on the
+    versions of bugwarrior and of every distribution providing services along
+    with the configuration file. """
+    from importlib_metadata import entry_points, version
+
+    try:
+        with open(get_config_path(), 'rb') as f:
+            digest = hashlib.blake2b(f.read(), digest_size=16)
+    except OSError:
+        return None
+    digest.update(main_section.encode())
+    digest.update(version('bugwarrior').encode())
+    dists = {ep.dist.name: ep.dist.version
+             for ep in entry_points(group='bugwarrior.service')}
+    for name, dist_version in sorted(dists.items()):
+        digest.update(f'{name}=={dist_version}'.encode())
+    return get_cache_path(f'udas.{digest.hexdigest()}.txt')
+
+
+def _write_uda_cache(cache_path, udas):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+    with os.fdopen(fd, 'w') as f:
+        f.write(udas)
+    os.replace(tmp_path, cache_path)
+
+
 @cli.command()
 @click.argument('rcfile', required=False, default=get_config_path(),
                 type=click.Path(exists=True))
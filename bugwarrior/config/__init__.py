@@ -3,7 +3,10 @@ Config API
 ----------
 """
 from .data import BugwarriorData
-from .load import BUGWARRIORRC, get_config_path, load_config  # noqa: F401
+from .load import (BUGWARRIORRC,  # noqa: F401
+                   get_cache_path,  # noqa: F401
+                   get_config_path,  # noqa: F401
+                   load_config)  # noqa: F401
 from .schema import (ConfigList,  # noqa: F401
                      ExpandedPath,  # noqa: F401
                      LoggingPath,  # noqa: F401
@@ -48,9 +48,10 @@ class BugwarriorData:
             return json.load(jsondata)
 
     def get(self, key) -> typing.Any:
-        """ Return a value stored in the ``bugwarrior.data`` file. """
+        """ Return a value stored in the ``bugwarrior.data`` file, or None if it
+        was never set. """
         try:
-            return self.get_data()[key]
+            return self.get_data().get(key)
         except OSError:  # File does not exist.
             return None
 
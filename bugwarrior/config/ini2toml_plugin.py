@@ -23,8 +23,8 @@ BOOLS = {
     'gitbug': ['import_labels_as_tags'],
     'github': ['include_user_repos', 'import_labels_as_tags',
                'filter_pull_requests', 'exclude_pull_requests',
-               'include_user_issues', 'involved_issues', 'project_owner_prefix'
-               ],
+               'include_user_issues', 'involved_issues', 'project_owner_prefix',
+               'use_graphql', 'etag_cache'],
     'gitlab': ['filter_merge_requests', 'membership', 'owned',
                'import_labels_as_tags', 'include_merge_requests',
                'include_issues', 'include_todos', 'include_all_todos',
@@ -38,7 +38,7 @@ BOOLS = {
                        'only_if_author', 'only_if_assigned'],
     'redmine': ['verify_ssl'],
     'taiga': ['include_tasks'],
-    'track': ['no_xmlrpc'],
+    'trac': ['no_xmlrpc', 'ticket_cache'],
     'trello': ['import_labels_as_tags'],
     'youtrack': ['anonymous', 'use_https', 'verify_ssl', 'incloud_instance',
                  'import_tags'],
@@ -58,7 +58,7 @@ INTEGERS = {
 
 CONFIGLIST = {
     'general': ['targets', 'static_tags', 'static_fields'],
-    'github': ['include_repos', 'exclude_repos', 'issue_urls'],
+    'github': ['include_repos', 'exclude_repos', 'issue_urls', 'extra_tokens'],
     'pivotaltracker': ['account_ids', 'exclude_projects', 'exclude_stories', 'exclude_tags'],
     'gitlab': ['include_repos', 'exclude_repos'],
     'bitbucket': ['include_repos', 'exclude_repos'],
@@ -64,6 +64,16 @@ def get_config_path():
     return paths[0]
 
 
+def get_cache_path(*paths):
+    """
+    Return the path to `paths` within bugwarrior's cache directory,
+    $XDG_CACHE_HOME/bugwarrior, defaulting to ~/.cache/bugwarrior.
+    """
+    xdg_cache_home = (
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'))
+    return os.path.join(xdg_cache_home, 'bugwarrior', *paths)
+
+
 def parse_file(configpath: str) -> dict:
     if os.path.splitext(configpath)[-1] == '.toml':
         with open(configpath, 'rb') as f:
@@ -9,8 +9,6 @@ import pydantic.v1
 import pydantic.v1.error_wrappers
 import taskw
 
-from bugwarrior.collect import get_service
-
 from .data import BugwarriorData, get_data_path
 
 log = logging.getLogger(__name__)
@@ -258,7 +256,9 @@ def validate_config(config: dict, main_section: str, config_path: str) -> dict:
             raise_validation_error(
                 f"No option 'service' in section: '{target}'", config_path)
 
-    # Construct Service Models
+    # Construct Service Models. Collecting issues needs neither the config
+    # schema nor the services until here, so their import is deferred.
+    from bugwarrior.collect import get_service
     target_schemas = {target: (get_service(service).CONFIG_SCHEMA, ...)
                       for target, service in servicemap.items()}
 
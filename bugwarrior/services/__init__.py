@@ -3,6 +3,7 @@ Service API
 -----------
 """
 import abc
+import json
 import os
 import re
 import typing
@@ -14,11 +15,19 @@ from jinja2 import Template
 import pytz
 import requests
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from bugwarrior.config import schema, secrets
 
 import logging
 log = logging.getLogger(__name__)
 
+# Characters replaced by underscores when converting labels to tags.
+LABEL_NORMALIZATION = re.compile(r'[^a-zA-Z0-9]')
+
 DOGPILE_CACHE_PATH = os.path.expanduser(''.join([
     os.getenv('XDG_CACHE_HOME', '~/.cache'), '/dagd-py3.dbm']))
 
@@ -94,6 +103,10 @@ class Issue(abc.ABC):
     #: system and the string values 'H', 'M' or 'L'.
     PRIORITY_MAP: dict
 
+    # Services may fetch thousands of issues; subclasses which add no
+    # attributes of their own can declare empty slots to drop the __dict__.
+    __slots__ = ('record', 'config', 'main_config', 'extra')
+
     def __init__(self,
                  foreign_record: dict,
                  config: schema.ServiceConfig,
@@ -143,11 +156,16 @@ class Issue(abc.ABC):
         if not getattr(self.config, toggle_option):
             return tags
 
+        template = getattr(self.config, template_option)
+        if template == '{{%s}}' % template_variable:
+            # The default template renders the normalized label unchanged.
+            return [LABEL_NORMALIZATION.sub('_', label) for label in labels]
+
         context = self.record.copy()
-        label_template = Template(getattr(self.config, template_option))
+        label_template = Template(template)
 
         for label in labels:
-            normalized_label = re.sub(r'[^a-zA-Z0-9]', '_', label)
+            normalized_label = LABEL_NORMALIZATION.sub('_', label)
             context.update({template_variable: normalized_label})
             tags.append(label_template.render(context))
 
@@ -225,6 +243,11 @@ class Service(abc.ABC):
     #: Which class defines this service's configuration options?
     CONFIG_SCHEMA: schema.ServiceConfig
 
+    # Secrets already resolved in this process, keyed on
+    # (keyring service, login, oracle) so the keyring or oracle command is
+    # only consulted once however many times a service is instantiated.
+    _password_cache: typing.Dict[tuple, str] = {}
+
     def __init__(self, config: schema.ServiceConfig, main_config: schema.MainSectionConfig):
         #: An object whose attributes are this service's configuration values.
         self.config = config
@@ -246,9 +269,13 @@ class Service(abc.ABC):
         password = getattr(self.config, key)
         keyring_service = self.get_keyring_service(self.config)
         if not password or password.startswith("@oracle:"):
-            password = secrets.get_service_password(
-                keyring_service, login, oracle=password,
-                interactive=self.main_config.interactive)
+            cache_key = (keyring_service, login, password)
+            if cache_key not in Service._password_cache:
+                Service._password_cache[cache_key] = (
+                    secrets.get_service_password(
+                        keyring_service, login, oracle=password,
+                        interactive=self.main_config.interactive))
+            password = Service._password_cache[cache_key]
         return password
 
     def get_issue_for_record(self, record, extra=None) -> Issue:
@@ -331,6 +358,17 @@ class Client:
     service in which the details of making and parsing http requests is
     compartmentalized.
     """
+    @staticmethod
+    def json_loads(content: bytes):
+        """ Decode a json document, e.g. the body of a cached response. """
+        if orjson is not None:
+            # Optional, considerably faster decoder.
+            try:
+                return orjson.loads(content)
+            except orjson.JSONDecodeError:
+                pass  # Let the standard decoder handle or report it.
+        return json.loads(content)
+
     @staticmethod
     def json_response(response: requests.Response):
         """ Return json if response is OK. """
@@ -340,12 +378,7 @@ class Client:
                 "Non-200 status code %r; %r; %r" % (
                     response.status_code, response.url, response.text,
                 ))
-        if callable(response.json):
-            # Newer python-requests
-            return response.json()
-        else:
-            # Older python-requests
-            return response.json
+        return Client.json_loads(response.content)
 
 
 # NOTE: __all__ determines the stable, public API.
@@ -1,14 +1,27 @@
+import concurrent.futures
+import hashlib
+import itertools
 import logging
+import math
+import threading
+import time
 import typing
+import urllib.parse
 
 import pydantic.v1
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from bugwarrior import config
 from bugwarrior.services import Service, Issue, Client
 
 log = logging.getLogger(__name__)
 
+CLOSED_ISSUE_STATES = frozenset(
+    ('resolved', 'duplicate', 'wontfix', 'invalid', 'closed'))
+CLOSED_PULL_REQUEST_STATES = frozenset(('rejected', 'fulfilled'))
+
 
 class BitbucketConfig(config.ServiceConfig):
     _DEPRECATE_FILTER_MERGE_REQUESTS = True
@@ -95,20 +108,63 @@ class BitbucketService(Service, Client):
     BASE_API2 = 'https://api.bitbucket.org/2.0'
     BASE_URL = 'https://bitbucket.org/'
 
+    # Upper bound on concurrent requests made against the API.
+    MAX_WORKERS = 10
+
+    # Partial responses: only request the fields which are actually used.
+    PAGE_FIELDS = 'next,size,pagelen'
+    REPO_FIELDS = PAGE_FIELDS + ',values.full_name,values.has_issues'
+    ISSUE_FIELDS = PAGE_FIELDS + (
+        ',values.id,values.title,values.status,values.state,values.priority'
+        ',values.assignee.username,values.links.html.href')
+    PULL_REQUEST_FIELDS = PAGE_FIELDS + (
+        ',values.id,values.title,values.state,values.links.html.href')
+    COMMENT_FIELDS = PAGE_FIELDS + (
+        ',values.user.username,values.content.raw')
+
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
 
+        self.include_repos = frozenset(self.config.include_repos)
+        self.exclude_repos = frozenset(self.config.exclude_repos)
+        # Pages are fetched from threads spawned by other fetching threads,
+        # so bound the requests in flight across all of them at once.
+        self.request_slots = threading.BoundedSemaphore(self.MAX_WORKERS)
+
+        # Share connections across the many requests made per pull.
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=16, pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5,
+                              status_forcelist=(429, 500, 502, 503, 504))))
+        self.session.headers['Authorization'] = (
+            f"Bearer {self.get_access_token()}")
+
+    def get_access_token(self):
+        """ Return an access token, reusing the last one until it expires or
+        the OAuth consumer changes. """
         oauth = (self.config.key, self.get_password('secret', self.config.key))
-        refresh_token = self.main_config.data.get('bitbucket_refresh_token')
+        fingerprint = hashlib.sha256(''.join(oauth).encode()).hexdigest()
+        if self.main_config.data.get(
+                'bitbucket_oauth_fingerprint') == fingerprint:
+            access_token = self.main_config.data.get('bitbucket_access_token')
+            expires_at = self.main_config.data.get(
+                'bitbucket_access_token_expires_at')
+            if access_token and expires_at and time.time() < expires_at - 60:
+                return access_token
+            refresh_token = self.main_config.data.get('bitbucket_refresh_token')
+        else:
+            # Tokens issued to another consumer cannot be reused.
+            refresh_token = None
 
         if refresh_token:
-            response = requests.post(
+            response = self.session.post(
                 self.BASE_URL + 'site/oauth2/access_token',
                 data={'grant_type': 'refresh_token',
                       'refresh_token': refresh_token},
                 auth=oauth).json()
         else:
-            response = requests.post(
+            response = self.session.post(
                 self.BASE_URL + 'site/oauth2/access_token',
                 data={'grant_type': 'client_credentials'},
                 auth=oauth).json()
@@ -116,8 +172,13 @@ class BitbucketService(Service, Client):
             self.main_config.data.set('bitbucket_refresh_token',
                                       response['refresh_token'])
 
-        self.requests_kwargs = {
-            'headers': {'Authorization': f"Bearer {response['access_token']}"}}
+        self.main_config.data.set('bitbucket_oauth_fingerprint', fingerprint)
+        self.main_config.data.set('bitbucket_access_token',
+                                  response['access_token'])
+        self.main_config.data.set('bitbucket_access_token_expires_at',
+                                  time.time() + response['expires_in'])
+
+        return response['access_token']
 
     @staticmethod
     def get_keyring_service(config):
@@ -126,12 +187,12 @@ class BitbucketService(Service, Client):
     def filter_repos(self, repo_tag):
         repo = repo_tag.split('/').pop()
 
-        if self.config.exclude_repos:
-            if repo in self.config.exclude_repos:
+        if self.exclude_repos:
+            if repo in self.exclude_repos:
                 return False
 
-        if self.config.include_repos:
-            if repo in self.config.include_repos:
+        if self.include_repos:
+            if repo in self.include_repos:
                 return True
             else:
                 return False
@@ -140,30 +201,79 @@ class BitbucketService(Service, Client):
 
     def get_data(self, url):
         """ Perform a request to the fully qualified url and return json. """
-        return self.json_response(requests.get(url, **self.requests_kwargs))
+        with self.request_slots:
+            response = self.session.get(url)
+        return self.json_response(response)
 
-    def get_collection(self, url):
+    def get_collection(self, url, params=None):
         """ Pages through an object collection from the bitbucket API.
         Returns an iterator that lazily goes through all the 'values'
         of all the pages in the collection. """
         url = self.BASE_API2 + url
-        while url is not None:
-            response = self.get_data(url)
-            yield from response['values']
-            url = response.get('next', None)
+        if params:
+            url += '?' + urllib.parse.urlencode(params, safe=',')
+        response = self.get_data(url)
+        yield from response['values']
+
+        if 'next' not in response:
+            return
+
+        size, pagelen = response.get('size'), response.get('pagelen')
+        if size is None or not pagelen:
+            # The total is unknown, so follow the 'next' links one by one.
+            url = response['next']
+            while url is not None:
+                response = self.get_data(url)
+                yield from response['values']
+                url = response.get('next', None)
+            return
+
+        # The total is known, so request the remaining pages concurrently.
+        page_urls = [
+            self._get_page_url(url, page)
+            for page in range(2, math.ceil(size / pagelen) + 1)]
+        with concurrent.futures.ThreadPoolExecutor(self.MAX_WORKERS) as pool:
+            for response in pool.map(self.get_data, page_urls):
+                yield from response['values']
+
+    @staticmethod
+    def _get_page_url(url, page):
+        """ Return the url of the given page of a paginated collection. """
+        parts = urllib.parse.urlsplit(url)
+        query = [(key, value)
+                 for key, value in urllib.parse.parse_qsl(parts.query)
+                 if key != 'page']
+        query.append(('page', page))
+        return parts._replace(
+            query=urllib.parse.urlencode(query, safe=',')).geturl()
 
     def fetch_issues(self, tag):
-        response = self.get_collection('/repositories/%s/issues/' % (tag))
-        return [(tag, issue) for issue in response]
+        response = self.get_collection(
+            f'/repositories/{tag}/issues/',
+            {'fields': self.ISSUE_FIELDS})
+        return ((tag, issue) for issue in response)
 
     def fetch_pull_requests(self, tag):
-        response = self.get_collection('/repositories/%s/pullrequests/' % tag)
-        return [(tag, issue) for issue in response]
+        response = self.get_collection(
+            f'/repositories/{tag}/pullrequests/',
+            {'fields': self.PULL_REQUEST_FIELDS})
+        return ((tag, issue) for issue in response)
+
+    def get_issue_annotations(self, tag, issue, issue_obj, url):
+        response = self.get_collection(
+            f'/repositories/{tag}/issues/{issue["id"]}/comments',
+            {'fields': self.COMMENT_FIELDS}
+        )
+        return self.build_comment_annotations(response, url)
 
     def get_annotations(self, tag, issue, issue_obj, url):
         response = self.get_collection(
-            '/repositories/%s/pullrequests/%i/comments' % (tag, issue['id'])
+            f'/repositories/{tag}/pullrequests/{issue["id"]}/comments',
+            {'fields': self.COMMENT_FIELDS}
         )
+        return self.build_comment_annotations(response, url)
+
+    def build_comment_annotations(self, response, url):
         return self.build_annotations(
             ((
                 comment['user']['username'],
@@ -191,65 +301,91 @@ class BitbucketService(Service, Client):
 
         return True
 
+    def filter_issues(self, issues, closed):
+        """ Lazily yield the (tag, issue) pairs from the per-repository lists
+        in `issues` which are not `closed` and should be included. """
+        issues = itertools.chain.from_iterable(issues)
+        first = next(issues, None)
+        # The 'status' field became 'state' in an undocumented API change, so
+        # check which one this response uses only once.
+        status_key = 'status' if first and 'status' in first[1] else 'state'
+
+        total = pruned = 0
+        for tup in itertools.chain((first,) if first else (), issues):
+            total += 1
+            if tup[1].get(status_key) not in closed and self.include(tup):
+                pruned += 1
+                yield tup
+        log.debug(" Found %i total.", total)
+        log.debug(" Pruned down to %i", pruned)
+
+    def get_repository_query(self):
+        """ Return a BBQL query selecting the repositories to pull from.
+
+        Excluded repositories are still removed by :meth:`filter_repos`.
+        """
+        query = 'has_issues=true'
+        if self.include_repos:
+            query += ' AND (%s)' % ' OR '.join(
+                f'full_name="{self.config.username}/{repo}"'
+                for repo in sorted(self.include_repos))
+        return query
+
     def issues(self):
         user = self.config.username
-        response = self.get_collection('/repositories/' + user + '/')
+        response = self.get_collection(
+            f'/repositories/{user}/',
+            {'fields': self.REPO_FIELDS, 'pagelen': 100,
+             'q': self.get_repository_query()})
         repo_tags = list(filter(self.filter_repos, [
             repo['full_name'] for repo in response
             if repo.get('has_issues')
         ]))
 
-        issues = sum((self.fetch_issues(repo) for repo in repo_tags), [])
-        log.debug(" Found %i total.", len(issues))
-
-        closed = ['resolved', 'duplicate', 'wontfix', 'invalid', 'closed']
-        try:
-            issues = [tup for tup in issues if tup[1]['status'] not in closed]
-        except KeyError:  # Undocumented API change.
-            issues = [tup for tup in issues if tup[1]['state'] not in closed]
-        issues = list(filter(self.include, issues))
-        log.debug(" Pruned down to %i", len(issues))
-
-        for tag, issue in issues:
-            issue_obj = self.get_issue_for_record(issue)
-            tagParts = tag.split('/')
-            projectName = tagParts[1]
-            if self.config.project_owner_prefix:
-                projectName = tagParts[0] + "." + projectName
-            url = issue['links']['html']['href']
-            extras = {
-                'project': projectName,
+        project_names = {}
+        for tag in repo_tags:
+            owner, repo = tag.split('/')[:2]
+            project_names[tag] = (
+                f'{owner}.{repo}' if self.config.project_owner_prefix
+                else repo)
+
+        # The fetch_* generators are drained in the pool so that the
+        # repositories are paged through concurrently.
+        with concurrent.futures.ThreadPoolExecutor(self.MAX_WORKERS) as pool:
+            issues = pool.map(
+                lambda tag: list(self.fetch_issues(tag)), repo_tags)
+            if self.config.include_merge_requests:
+                pull_requests = pool.map(
+                    lambda tag: list(self.fetch_pull_requests(tag)), repo_tags)
+
+            issues = [
+                (tag, issue, self.get_issue_for_record(issue),
+                 issue['links']['html']['href'])
+                for tag, issue in self.filter_issues(
+                    issues, CLOSED_ISSUE_STATES)]
+            yield from self.annotate_issues(
+                pool, self.get_issue_annotations, issues, project_names)
+
+            if self.config.include_merge_requests:
+                pull_requests = [
+                    (tag, issue, self.get_issue_for_record(issue),
+                     self.BASE_URL + '/'.join(
+                         issue['links']['html']['href'].split('/')[3:]
+                     ).replace('pullrequests', 'pullrequest'))
+                    for tag, issue in self.filter_issues(
+                        pull_requests, CLOSED_PULL_REQUEST_STATES)]
+                yield from self.annotate_issues(
+                    pool, self.get_annotations, pull_requests, project_names)
+
+    def annotate_issues(self, pool, get_annotations, issues, project_names):
+        """ Fetch the annotations of (tag, issue, issue_obj, url) tuples
+        concurrently and yield the completed issue objects in order. """
+        annotations = pool.map(lambda args: get_annotations(*args), issues)
+        for (tag, issue, issue_obj, url), issue_annotations in zip(
+                issues, annotations):
+            issue_obj.extra.update({
+                'project': project_names[tag],
                 'url': url,
-                'annotations': self.get_annotations(tag, issue, issue_obj, url)
-            }
-            issue_obj.extra.update(extras)
+                'annotations': issue_annotations,
+            })
             yield issue_obj
-
-        if self.config.include_merge_requests:
-            pull_requests = sum(
-                (self.fetch_pull_requests(repo) for repo in repo_tags), [])
-            log.debug(" Found %i total.", len(pull_requests))
-
-            closed = ['rejected', 'fulfilled']
-            def not_resolved(tup): return tup[1]['state'] not in closed
-            pull_requests = list(filter(not_resolved, pull_requests))
-            pull_requests = list(filter(self.include, pull_requests))
-            log.debug(" Pruned down to %i", len(pull_requests))
-
-            for tag, issue in pull_requests:
-                issue_obj = self.get_issue_for_record(issue)
-                tagParts = tag.split('/')
-                projectName = tagParts[1]
-                if self.config.project_owner_prefix:
-                    projectName = tagParts[0] + "." + projectName
-                url = self.BASE_URL + '/'.join(
-                    issue['links']['html']['href'].split('/')[3:]
-                ).replace('pullrequests', 'pullrequest')
-                extras = {
-                    'project': projectName,
-                    'url': url,
-                    'annotations': self.get_annotations(
-                        tag, issue, issue_obj, url)
-                }
-                issue_obj.extra.update(extras)
-                yield issue_obj
@@ -1,17 +1,84 @@
+import concurrent.futures
+import os
 import re
+import sqlite3
 import sys
+import threading
+import time
 import typing
 import urllib.parse
+import zlib
 
 import pydantic.v1
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from bugwarrior import config
+from bugwarrior.config import secrets
 from bugwarrior.services import Service, Issue, Client
 
 import logging
 log = logging.getLogger(__name__)
 
+# Path of an issue or pull request, e.g. /owner/repo/issues/1.
+ISSUE_PATH_PATTERN = re.compile(r'^/.*/.*/(issues|pull)/[0-9]*$')
+# The pull request url is '/pull/' but the api path is '/pulls/'.
+PULL_PATH_PATTERN = re.compile(r'pull(?=/[0-9]*$)')
+# The owner/repo of an issue path or of a repository api url.
+REPO_PATH_PATTERN = re.compile(r'(?<=^/)(.*/.*)(?=/(issues|pull)/[0-9]*$)')
+REPO_URL_PATTERN = re.compile(r'.*/([^/]*/[^/]*)$')
+# A part of the Link header, e.g. <https://...?page=2>; rel="next".
+LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="([^"]+)"')
+
+# Open issues and pull requests of all repositories owned by a user or an
+# organization, and optionally their comments. The page sizes keep the query well under GitHub's
+# limit on the number of nodes.
+USER_REPOS_ISSUES_QUERY = """
+fragment issueFields on Issue {
+  number title body url createdAt updatedAt closedAt state
+  author { login }
+  milestone { title }
+  labels(first: 20) { pageInfo { hasNextPage } nodes { name } }
+  assignees(first: 1) { nodes { login } }
+  comments(first: 20) @include(if: $comments) {
+    pageInfo { hasNextPage }
+    nodes { author { login } body }
+  }
+}
+
+fragment pullRequestFields on PullRequest {
+  number title body url createdAt updatedAt closedAt state isDraft
+  author { login }
+  milestone { title }
+  labels(first: 20) { pageInfo { hasNextPage } nodes { name } }
+  assignees(first: 1) { nodes { login } }
+  comments(first: 20) @include(if: $comments) {
+    pageInfo { hasNextPage }
+    nodes { author { login } body }
+  }
+}
+
+query($login: String!, $cursor: String, $comments: Boolean!) {
+  repositoryOwner(login: $login) {
+    repositories(first: 20, after: $cursor, ownerAffiliations: OWNER) {
+      pageInfo { endCursor hasNextPage }
+      nodes {
+        name
+        issues(first: 50, states: OPEN) {
+          pageInfo { hasNextPage }
+          nodes { ...issueFields }
+        }
+        pullRequests(first: 50, states: OPEN) {
+          pageInfo { hasNextPage }
+          nodes { ...pullRequestFields }
+        }
+      }
+    }
+  }
+}
+"""
+
 
 class GithubConfig(config.ServiceConfig):
     password: str = 'Deprecated'
@@ -40,14 +107,17 @@ class GithubConfig(config.ServiceConfig):
     body_length: int = sys.maxsize
     project_owner_prefix: bool = False
     issue_urls: config.ConfigList = config.ConfigList([])
+    extra_tokens: config.ConfigList = config.ConfigList([])
+    use_graphql: bool = False
+    etag_cache: bool = True
 
-    @pydantic.v1.root_validator
-    def deprecate_password(cls, values):
-        if values['password'] != 'Deprecated':
+    @pydantic.v1.validator('password')
+    def deprecate_password(cls, value):
+        if value != 'Deprecated':
             log.warning(
                 'Basic auth is no longer supported. Please remove '
                 '"password" in favor of "token".')
-        return values
+        return value
 
     @pydantic.v1.root_validator
     def require_username_or_query(cls, values):
@@ -56,20 +126,29 @@ class GithubConfig(config.ServiceConfig):
                 'section requires one of:\n    username\n    query')
         return values
 
-    @pydantic.v1.root_validator
-    def issue_urls_consistent_with_host(cls, values):
+    @pydantic.v1.validator('issue_urls')
+    def issue_urls_consistent_with_host(cls, value, values):
         issue_url_paths = []
-        for url in values['issue_urls']:
+        for url in value:
             parsed_url = urllib.parse.urlparse(url)
-            if parsed_url.netloc != values['host']:
+            if parsed_url.netloc != values.get('host'):
                 raise ValueError(
-                    f'issue_urls: {url} inconsistent with host {values["host"]}')
-            if not re.match(r'^/.*/.*/(issues|pull)/[0-9]*$', parsed_url.path):
+                    f'{url} inconsistent with host {values.get("host")}')
+            if not ISSUE_PATH_PATTERN.match(parsed_url.path):
                 raise ValueError(
-                    f'issue_urls: {parsed_url.path} is not a valid issue path')
+                    f'{parsed_url.path} is not a valid issue path')
             issue_url_paths.append(parsed_url.path)
-        values['issue_urls'] = issue_url_paths
-        return values
+        return issue_url_paths
+
+    @pydantic.v1.validator('extra_tokens')
+    def extra_tokens_plain_or_eval(cls, value):
+        for token in value:
+            if (token.startswith('@oracle:')
+                    and not token.startswith('@oracle:eval:')):
+                raise ValueError(
+                    f'{token} is not supported, extra tokens may only be '
+                    'given in plain text or through @oracle:eval:')
+        return value
 
     @pydantic.v1.root_validator
     def require_username_if_include_user_repos(cls, values):
@@ -79,14 +158,78 @@ class GithubConfig(config.ServiceConfig):
         return values
 
 
+class EtagCache:
+    """ On-disk store of the ETag, body and Link header of GET responses.
+
+    GitHub answers a request whose If-None-Match header matches the current
+    ETag with a 304, which does not count against the rate limit, so pages
+    which have not changed since the last pull are not transferred again.
+    Pages which were not requested for :attr:`MAX_AGE` seconds, such as those
+    of issues closed since, are dropped when the cache is opened.
+    """
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    def __init__(self, path):
+        # The cache holds the bodies of private issues and comments.
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # The connection is shared by the fetching threads.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        os.chmod(path, 0o600)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS etags (url TEXT PRIMARY KEY, '
+                'etag TEXT, content BLOB, link TEXT, used REAL)')
+            self.connection.execute(
+                'DELETE FROM etags WHERE used < ?',
+                (time.time() - self.MAX_AGE,))
+
+    @staticmethod
+    def get_path():
+        return config.get_cache_path('github-etags.db')
+
+    def get(self, url):
+        """ Return the (etag, content, link) cached for `url`, or None. """
+        with self.lock, self.connection:
+            cached = self.connection.execute(
+                'SELECT etag, content, link FROM etags WHERE url = ?',
+                (url,)).fetchone()
+            if cached is not None:
+                self.connection.execute(
+                    'UPDATE etags SET used = ? WHERE url = ?',
+                    (time.time(), url))
+            return cached
+
+    def set(self, url, etag, content, link):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO etags VALUES (?, ?, ?, ?, ?)',
+                (url, etag, content, link, time.time()))
+
+
 class GithubClient(Client):
-    def __init__(self, host, auth):
+    def __init__(self, host, auth, etag_cache=None):
         self.host = host
         self.auth = auth
+        self.etag_cache = etag_cache
+        # Comments which came along with GraphQL issues, by issue.
+        self.preloaded_comments = {}
+        # Share connections across the pages fetched concurrently, and ride
+        # out GitHub's occasional 502s and secondary rate limits.
         self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=32, pool_maxsize=32,
+            max_retries=Retry(total=5, backoff_factor=0.5,
+                              status_forcelist=(429, 502, 503, 504),
+                              allowed_methods=('GET', 'POST'))))
+        self.tokens = []
         if 'token' in self.auth:
             authorization = 'token ' + self.auth['token']
             self.session.headers['Authorization'] = authorization
+            self.tokens = [
+                self.auth['token'], *self.auth.get('extra_tokens', [])]
+        # Time at which the rate limit of the exhausted tokens is reset.
+        self.token_resets = {}
 
         self.kwargs = {}
         if 'basic' in self.auth:
@@ -100,6 +243,91 @@ class GithubClient(Client):
             baseurl = f"https://{self.host}/api/v3"
         return baseurl + path.format(**context)
 
+    def _graphql_url(self):
+        if self.host == 'github.com':
+            return "https://api.github.com/graphql"
+        return f"https://{self.host}/api/graphql"
+
+    def graphql(self, query, variables):
+        """ Run a GraphQL query and return its data. """
+        url = self._graphql_url()
+        response = self._send(
+            'POST', url, json={'query': query, 'variables': variables})
+        json_res = self.json_response(response)
+        if json_res.get('errors'):
+            raise OSError(f"GraphQL query failed: {json_res['errors']!r}")
+        return json_res['data']
+
+    def get_user_repos_issues(self, username, comments=False):
+        """ Yield (repo, issues) for every repository owned by `username`,
+        which may be a user or an organization.
+
+        The open issues and pull requests of 20 repositories are fetched per
+        GraphQL request and converted to the shape of the REST API. `issues`
+        is None for repositories with more open issues or pull requests, or
+        issues with more labels, than fit in one request; use
+        :meth:`get_issues` for those. With `comments`, the comments are
+        fetched along and returned by :meth:`get_comments`.
+        """
+        variables = {'login': username, 'cursor': None, 'comments': comments}
+        while True:
+            data = self.graphql(USER_REPOS_ISSUES_QUERY, variables)
+            if data['repositoryOwner'] is None:
+                raise OSError(f"No GitHub user or organization {username}")
+            repositories = data['repositoryOwner']['repositories']
+            for repo in repositories['nodes']:
+                nodes = repo['issues']['nodes'] + repo['pullRequests']['nodes']
+                if (repo['issues']['pageInfo']['hasNextPage']
+                        or repo['pullRequests']['pageInfo']['hasNextPage']
+                        or any(node['labels']['pageInfo']['hasNextPage']
+                               for node in nodes)):
+                    yield repo['name'], None
+                    continue
+                issues = [
+                    self._issue_from_graphql(username, repo['name'], node)
+                    for node in repo['issues']['nodes']]
+                issues += [
+                    self._issue_from_graphql(
+                        username, repo['name'], node, pull_request=True)
+                    for node in repo['pullRequests']['nodes']]
+                yield repo['name'], issues
+
+            if not repositories['pageInfo']['hasNextPage']:
+                break
+            variables['cursor'] = repositories['pageInfo']['endCursor']
+
+    def _issue_from_graphql(self, username, repo, node, pull_request=False):
+        """ Convert a GraphQL issue or pull request to a REST API issue. """
+        assignees = node['assignees']['nodes']
+        issue = {
+            'url': self._api_url(
+                "/repos/{username}/{repo}/issues/{number}",
+                username=username, repo=repo, number=node['number']),
+            'html_url': node['url'],
+            'number': node['number'],
+            'title': node['title'],
+            'body': node['body'],
+            # Deleted accounts have no author.
+            'user': node['author'] or {'login': 'ghost'},
+            'milestone': node['milestone'],
+            'labels': node['labels']['nodes'],
+            'assignee': assignees[0] if assignees else None,
+            'created_at': node['createdAt'],
+            'updated_at': node['updatedAt'],
+            'closed_at': node['closedAt'],
+            'state': node['state'].lower(),
+        }
+        if pull_request:
+            issue['pull_request'] = {'html_url': node['url']}
+            issue['draft'] = node['isDraft']
+        # Issues with more comments than fit in the request fall back to REST.
+        if 'comments' in node and not node['comments']['pageInfo']['hasNextPage']:
+            self.preloaded_comments[username, repo, node['number']] = [
+                {'user': comment['author'] or {'login': 'ghost'},
+                 'body': comment['body']}
+                for comment in node['comments']['nodes']]
+        return issue
+
     def get_repos(self, username):
         user_repos = self._getter(self._api_url("/user/repos?per_page=100"))
         public_repos = self._getter(self._api_url(
@@ -110,13 +338,13 @@ class GithubClient(Client):
         """Run a generic issue/PR query"""
         url = self._api_url(
             "/search/issues?q={query}&per_page=100", query=query)
-        return self._getter(url, subkey='items')
+        return self._getter_iter(url, subkey='items')
 
     def get_issues(self, username, repo):
         url = self._api_url(
             "/repos/{username}/{repo}/issues?per_page=100",
             username=username, repo=repo)
-        return self._getter(url)
+        return self._getter_iter(url)
 
     def get_directly_assigned_issues(self):
         """ Returns all issues assigned to authenticated user.
@@ -126,46 +354,97 @@ class GithubClient(Client):
         organization repositories.
         """
         url = self._api_url("/issues?per_page=100")
-        return self._getter(url)
+        return self._getter_iter(url)
 
     def get_issue_for_url_path(self, url_path):
-        # The pull request url is '/pull/' but the api path is '/pulls/'.
-        api_path = re.sub(r'pull(?=/[0-9]*$)', 'pulls', url_path)
+        api_path = PULL_PATH_PATTERN.sub('pulls', url_path)
         url = self._api_url(f'/repos{api_path}')
-        return self.json_response(self._request(url))
+        return self._get_json(url)[0]
 
     def get_comments(self, username, repo, number):
+        preloaded = self.preloaded_comments.pop((username, repo, number), None)
+        if preloaded is not None:
+            return preloaded
         url = self._api_url(
             "/repos/{username}/{repo}/issues/{number}/comments?per_page=100",
             username=username, repo=repo, number=number)
-        return self._getter(url)
+        return self._getter_iter(url)
 
     def get_pulls(self, username, repo):
         url = self._api_url(
             "/repos/{username}/{repo}/pulls?per_page=100",
             username=username, repo=repo)
-        return self._getter(url)
+        return self._getter_iter(url)
 
     def _getter(self, url, subkey=None):
         """ Pagination utility.  Obnoxious. """
-        results = []
+        return list(self._getter_iter(url, subkey))
+
+    def _getter_iter(self, url, subkey=None):
+        """ Like :meth:`_getter`, but fetch the pages as they are consumed. """
         link = dict(next=url)
 
         while 'next' in link:
-            response = self._request(link['next'])
-            json_res = self.json_response(response)
+            json_res, link_field = self._get_json(link['next'])
 
             if subkey is not None:
                 json_res = json_res[subkey]
 
-            results += json_res
+            yield from json_res
+
+            link = self._link_field_to_dict(link_field)
 
-            link = self._link_field_to_dict(response.headers.get('link', None))
+    def _get_json(self, url):
+        """ Return the json and Link header of `url`, reusing the cached
+        response if GitHub reports that it has not been modified. """
+        cached = self.etag_cache.get(url) if self.etag_cache else None
+        headers = {'If-None-Match': cached[0]} if cached else {}
 
-        return results
+        response = self._request(url, headers=headers)
+        if cached and response.status_code == 304:
+            _, content, link_field = cached
+            return self.json_loads(content), link_field
 
-    def _request(self, url):
-        response = self.session.get(url, **self.kwargs)
+        json_res = self.json_response(response)
+        link_field = response.headers.get('link', None)
+        if self.etag_cache and 'ETag' in response.headers:
+            # Keep the body as sent, it is cheaper to decode than to encode.
+            self.etag_cache.set(
+                url, response.headers['ETag'], response.content, link_field)
+        return json_res, link_field
+
+    def _get_token(self, url):
+        """ Pick the token to request `url` with.
+
+        The tokens share out the urls rather than taking turns, since the
+        ETags of a page differ per token. Tokens whose rate limit is
+        exhausted are skipped until it is reset.
+        """
+        start = zlib.crc32(url.encode()) % len(self.tokens)
+        now = time.time()
+        for i in range(len(self.tokens)):
+            token = self.tokens[(start + i) % len(self.tokens)]
+            if self.token_resets.get(token, 0) <= now:
+                return token
+        return self.tokens[start]
+
+    def _send(self, method, url, headers=None, **kwargs):
+        headers = dict(headers or {})
+        # A single token is sent with the session's headers.
+        token = self._get_token(url) if len(self.tokens) > 1 else None
+        if token:
+            headers['Authorization'] = 'token ' + token
+
+        response = self.session.request(
+            method, url, headers=headers, **kwargs, **self.kwargs)
+
+        if token and response.headers.get('X-RateLimit-Remaining') == '0':
+            self.token_resets[token] = int(
+                response.headers.get('X-RateLimit-Reset', 0))
+        return response
+
+    def _request(self, url, headers=None):
+        response = self._send('GET', url, headers=headers)
 
         # Warn about the mis-leading 404 error code.  See:
         # https://github.com/ralphbean/bugwarrior/issues/374
@@ -179,18 +458,12 @@ class GithubClient(Client):
 
     @staticmethod
     def _link_field_to_dict(field):
-        """ Utility for ripping apart github's Link header field.
-        It's kind of ugly.
-        """
+        """ Utility for ripping apart github's Link header field. """
 
         if not field:
             return dict()
 
-        return {
-            part.split('; ')[1][5:-1]:
-            part.split('; ')[0][1:-1]
-            for part in field.split(', ')
-        }
+        return {rel: url for url, rel in LINK_PATTERN.findall(field)}
 
 
 class GithubIssue(Issue):
@@ -318,17 +591,38 @@ class GithubIssue(Issue):
 class GithubService(Service):
     ISSUE_CLASS = GithubIssue
     CONFIG_SCHEMA = GithubConfig
+    # Number of repositories or issues fetched concurrently.
+    MAX_WORKERS = 10
 
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
 
+        self.include_repos = frozenset(self.config.include_repos)
+        self.exclude_repos = frozenset(self.config.exclude_repos)
+
         auth = {'token': self.get_password('token', self.config.login)}
-        self.client = GithubClient(self.config.host, auth)
+        if self.config.extra_tokens:
+            auth['extra_tokens'] = [
+                self.get_extra_token(token)
+                for token in self.config.extra_tokens]
+        etag_cache = (
+            EtagCache(EtagCache.get_path()) if self.config.etag_cache
+            else None)
+        self.client = GithubClient(self.config.host, auth, etag_cache)
 
     @staticmethod
     def get_keyring_service(config):
         return f"github://{config.login}@{config.host}/{config.username}"
 
+    def get_extra_token(self, token):
+        """ Resolve an additional token, which may only come from an
+        ``@oracle:eval:`` command since the keyring holds a single one. """
+        if token.startswith('@oracle:eval:'):
+            return secrets.get_service_password(
+                self.get_keyring_service(self.config), self.config.login,
+                oracle=token, interactive=self.main_config.interactive)
+        return token
+
     def get_owned_repo_issues(self, tag):
         """ Grab all the issues """
         issues = {}
@@ -360,7 +654,7 @@ class GithubService(Service):
         issues = {}
         for url_path in self.config.issue_urls:
             issue = self.client.get_issue_for_url_path(url_path)
-            repo = re.search(r'(?<=^/)(.*/.*)(?=/(issues|pull)/[0-9]*$)', url_path)[0]
+            repo = REPO_PATH_PATTERN.search(url_path)[0]
             issues[url_path] = (repo, issue)
         return issues
 
@@ -374,7 +668,7 @@ class GithubService(Service):
             url = issue['repository_url']
         else:
             raise ValueError("Issue has no repository url" + str(issue))
-        tag = re.match('.*/([^/]*/[^/]*)$', url)
+        tag = REPO_URL_PATTERN.match(url)
         if tag is None:
             raise ValueError(f"Unrecognized URL: {url}.")
         return tag.group(1)
@@ -385,14 +679,14 @@ class GithubService(Service):
 
     def annotations(self, tag, issue):
         url = issue['html_url']
-        annotations = []
-        if self.main_config.annotation_comments:
-            comments = self._comments(tag, issue['number'])
-            log.debug(" got comments for %s", issue['html_url'])
-            annotations = ((
-                c['user']['login'],
-                c['body'],
-            ) for c in comments)
+        if not self.main_config.annotation_comments:
+            return self.build_annotations((), url)
+        comments = self._comments(tag, issue['number'])
+        log.debug(" got comments for %s", issue['html_url'])
+        annotations = ((
+            c['user']['login'],
+            c['body'],
+        ) for c in comments)
         return self.build_annotations(annotations, url)
 
     def body(self, issue):
@@ -401,7 +695,8 @@ class GithubService(Service):
         if body:
             body = body.replace('\r\n', '\n')
             max_length = self.config.body_length
-            body = body[:max_length]
+            if len(body) > max_length:
+                body = body[:max_length]
 
         return body
 
@@ -427,11 +722,11 @@ class GithubService(Service):
         return self.filter_repo_name(repo['name'])
 
     def filter_repo_name(self, name):
-        if name in self.config.exclude_repos:
+        if name in self.exclude_repos:
             return False
 
-        if self.config.include_repos:
-            if name in self.config.include_repos:
+        if self.include_repos:
+            if name in self.include_repos:
                 return True
             else:
                 return False
@@ -470,16 +765,30 @@ class GithubService(Service):
             # include_repos list is not specified.
             if self.config.include_repos:
                 repos = self.config.include_repos
+            elif self.config.use_graphql:
+                repos = []
+                for repo, repo_issues in self.client.get_user_repos_issues(
+                        self.config.username,
+                        comments=self.main_config.annotation_comments):
+                    if not self.filter_repo_name(repo):
+                        continue
+                    if repo_issues is None:
+                        # Too many to batch, page through the REST API.
+                        repos.append(repo)
+                        continue
+                    tag = self.config.username + "/" + repo
+                    issues.update(
+                        (issue['url'], (tag, issue)) for issue in repo_issues)
             else:
                 all_repos = self.client.get_repos(self.config.username)
                 repos = filter(self.filter_repos, all_repos)
                 repos = [repo['name'] for repo in repos]
 
-            for repo in repos:
-                issues.update(
-                    self.get_owned_repo_issues(
-                        self.config.username + "/" + repo)
-                )
+            tags = [self.config.username + "/" + repo for repo in repos]
+            with concurrent.futures.ThreadPoolExecutor(
+                    self.MAX_WORKERS) as pool:
+                for repo_issues in pool.map(self.get_owned_repo_issues, tags):
+                    issues.update(repo_issues)
         if self.config.include_user_issues:
             issues.update(
                 filter(self.filter_issues,
@@ -492,7 +801,17 @@ class GithubService(Service):
         issues = list(filter(self.include, issues.values()))
         log.debug(" Pruned down to %i issues.", len(issues))
 
-        for tag, issue in issues:
+        if self.main_config.annotation_comments:
+            # The comments are the bulk of the requests, fetch them
+            # concurrently.
+            with concurrent.futures.ThreadPoolExecutor(
+                    self.MAX_WORKERS) as pool:
+                annotations = list(pool.map(
+                    lambda args: self.annotations(*args), issues))
+        else:
+            annotations = [self.annotations(*issue) for issue in issues]
+
+        for (tag, issue), issue_annotations in zip(issues, annotations):
             # Stuff this value into the upstream dict for:
             # https://github.com/ralphbean/bugwarrior/issues/159
             issue['repo'] = tag
@@ -505,7 +824,7 @@ class GithubService(Service):
             extra = {
                 'project': projectName,
                 'type': 'pull_request' if 'pull_request' in issue else 'issue',
-                'annotations': self.annotations(tag, issue),
+                'annotations': issue_annotations,
                 'body': self.body(issue),
                 'namespace': self.config.username,
             }
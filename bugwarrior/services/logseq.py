@@ -1,3 +1,5 @@
+import concurrent.futures
+import functools
 import logging
 import typing
 
@@ -11,6 +13,33 @@ from bugwarrior.services import Service, Issue, Client
 
 log = logging.getLogger(__name__)
 
+# e.g. SCHEDULED: <2024-06-20 Thu 10:55 .+1d>, capturing the date, hour and minute
+SCHEDULED_DATE_PATTERN = re.compile(
+    r"(?:SCHEDULED|DEADLINE): <(\d{4}-\d{2}-\d{2}) [^ >]+"
+    r"(?: (\d{1,2}):(\d{2}))?(?: [.+][^ >]*)?>"
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tag_patterns(char_open_link, char_close_link):
+    """ Return the patterns matching #tagname and #[[multi word]] tags. """
+    return (
+        # this includes #tagname, but ignores tags that are in the #[[tag name]] format
+        re.compile(r"(#[^" + char_open_link + r"^\s]+)"),
+        # and this matches the #[[multi word]] formatted tags
+        re.compile(r"(#[" + char_open_link + r"].*[" + char_close_link + r"])"),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_unescape_table(char_open_bracket, char_close_bracket):
+    """ Return the translation table of the single characters to replace. """
+    return str.maketrans({
+        '"': "'",  # prevent &dquote; in task details
+        "[": char_open_bracket,  # prevent &open; and &close;
+        "]": char_close_bracket,
+    })
+
 
 class LogseqConfig(config.ServiceConfig):
     service: typing.Literal["logseq"]
@@ -39,12 +68,21 @@ class LogseqClient(Client):
             "Authorization": "Bearer " + self.token,
             "content-type": "application/json; charset=utf-8",
         }
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+
+        # The query only depends on the configured task states.
+        self.issues_query = f"""
+            [:find (pull ?b [*])
+                :where [?b :block/marker ?marker]
+                [(contains? #{{{self.filter}}} ?marker)]
+            ]
+        """
 
     def _datascript_query(self, query):
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"http://{self.host}:{self.port}/api",
-                headers=self.headers,
                 json={"method": "logseq.DB.datascriptQuery", "args": [query]},
             )
             return self.json_response(response)
@@ -54,9 +92,8 @@ class LogseqClient(Client):
 
     def _get_current_graph(self):
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"http://{self.host}:{self.port}/api",
-                headers=self.headers,
                 json={"method": "logseq.getCurrentGraph", "args": []},
             )
             return self.json_response(response)
@@ -69,15 +106,11 @@ class LogseqClient(Client):
         return graph["name"] if graph else None
 
     def get_issues(self):
-        query = f"""
-            [:find (pull ?b [*])
-                :where [?b :block/marker ?marker]
-                [(contains? #{{{self.filter}}} ?marker)]
-            ]
-        """
-        result = self._datascript_query(query)
+        result = self._datascript_query(self.issues_query)
         if "error" in result:
-            log.fatal("Error querying Logseq: %s using query %s", result["error"], query)
+            log.fatal(
+                "Error querying Logseq: %s using query %s",
+                result["error"], self.issues_query)
             exit(1)
         return result
 
@@ -150,11 +183,10 @@ class LogseqIssue(Issue):
     # this is a workaround for https://github.com/ralphbean/taskw/issues/172
     def _unescape_content(self, content):
         return (
-            content.replace('"', "'")  # prevent &dquote; in task details
-            .replace("[[", self.config.char_open_link)  # alternate brackets for linked items
+            content.replace("[[", self.config.char_open_link)  # alternate brackets for linked items
             .replace("]]", self.config.char_close_link)
-            .replace("[", self.config.char_open_bracket)  # prevent &open; and &close;
-            .replace("]", self.config.char_close_bracket)
+            .translate(get_unescape_table(
+                self.config.char_open_bracket, self.config.char_close_bracket))
         )
 
     # remove brackets and spaces to compress display format of mutli work tags
@@ -166,8 +198,9 @@ class LogseqIssue(Issue):
             .replace(self.config.char_close_link, "")
         )
 
-    # get an optimized and formatted title
-    def get_formatted_title(self):
+    # get an optimized and formatted title, used by the task and its description
+    @functools.cached_property
+    def formatted_title(self):
         # use first line only and remove priority
         first_line = (
             self.record["content"]
@@ -180,16 +213,10 @@ class LogseqIssue(Issue):
 
     # get a list of tags from the task content
     def get_tags_from_content(self):
-        # this includes #tagname, but ignores tags that are in the #[[tag name]] format
-        tags = re.findall(
-            r"(#[^" + self.config.char_open_link + r"^\s]+)",
-            self.get_formatted_title()
-        )
-        # and this adds the #[[multi word]] formatted tags
-        tags.extend(re.findall(
-            r"(#[" + self.config.char_open_link + r"].*[" + self.config.char_close_link + r"])",
-            self.get_formatted_title()
-        ))
+        single_word, multi_word = get_tag_patterns(
+            self.config.char_open_link, self.config.char_close_link)
+        title = self.formatted_title
+        tags = single_word.findall(title) + multi_word.findall(title)
         # compress format to single words
         tags = [self._compress_tag_format(t) for t in tags]
         return tags
@@ -217,32 +244,19 @@ class LogseqIssue(Issue):
         return self.record["marker"]
 
     def get_scheduled_date(self, scheduled):
-        # format is <YYYY-MO-DD DAY HH:MM .+1d>
+        # format is <YYYY-MO-DD DAY HH:MM .+1d>, the time and repeater are optional
         # e.g. <2024-06-20 Thu 10:55 .+1d>
-        date_split = (
-            scheduled.replace("DEADLINE: <", "")
-            .replace("SCHEDULED: <", "")
-            .replace(">", "")
-            .split(" ")
-        )
-        if len(date_split) == 2:  # <date day>
-            date = date_split[0]
-            date_format = "%Y-%m-%d"
-        elif len(date_split) == 3 and (date_split[2][0] in ("+", ".")):  # <date day repeat>
-            date = date_split[0]
-            date_format = "%Y-%m-%d"
-        elif len(date_split) == 3:  # <date day time>
-            date = date_split[0] + " " + date_split[2]
-            date_format = "%Y-%m-%d %H:%M"
-        elif len(date_split) == 4:  # <date date time repeat>
-            date = date_split[0] + " " + date_split[2]
-            date_format = "%Y-%m-%d %H:%M"
-        else:
+        match = SCHEDULED_DATE_PATTERN.match(scheduled)
+        if not match:
             log.warning(f"Could not determine date format from {scheduled}")
             return None
 
+        date, hour, minute = match.groups()
         try:
-            return datetime.strptime(date, date_format)
+            date = datetime.fromisoformat(date)
+            if hour is not None:
+                date = date.replace(hour=int(hour), minute=int(minute))
+            return date
         except ValueError:
             log.warning(f"Could not parse date {date} from {scheduled}")
         return None
@@ -269,13 +283,13 @@ class LogseqIssue(Issue):
             self.ID: self.record["id"],
             self.UUID: self.record["uuid"],
             self.STATE: self.record["marker"],
-            self.TITLE: self.get_formatted_title(),
+            self.TITLE: self.formatted_title,
             self.URI: self.get_url(),
         }
 
     def get_default_description(self):
         return self.build_default_description(
-            title=self.get_formatted_title(),
+            title=self.formatted_title,
             url=self.get_url() if self.config.inline_links else '',
             number=self.record["id"],
             cls="issue",
@@ -297,7 +311,12 @@ class LogseqService(Service):
         )
 
     def issues(self):
-        graph_name = self.client.get_graph_name()
-        for issue in self.client.get_issues():
+        # The API does not batch calls, send both at once instead.
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            graph_name = pool.submit(self.client.get_graph_name)
+            issues = pool.submit(self.client.get_issues)
+            graph_name = graph_name.result()
+            issues = issues.result()
+        for issue in issues:
             extra = {"graph": graph_name}
             yield self.get_issue_for_record(issue[0], extra)
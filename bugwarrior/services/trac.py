@@ -1,10 +1,17 @@
+import contextlib
 import csv
-import io as StringIO
+import dbm
+import hashlib
+import io
+import os
+import shelve
 import typing
 import urllib.parse
 
 import offtrac
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from bugwarrior import config
 from bugwarrior.services import Issue, Service
@@ -19,11 +26,14 @@ class TracConfig(config.ServiceConfig):
 
     scheme: str = 'https'
     no_xmlrpc: bool = False
+    ticket_cache: bool = True
     username: str = ''
     password: str = ''
 
 
 class TracIssue(Issue):
+    __slots__ = ()
+
     SUMMARY = 'tracsummary'
     URL = 'tracurl'
     NUMBER = 'tracnumber'
@@ -58,15 +68,16 @@ class TracIssue(Issue):
     }
 
     def to_taskwarrior(self):
+        record, extra = self.record, self.extra
         return {
-            'project': self.extra['project'],
+            'project': extra['project'],
             'priority': self.get_priority(),
-            'annotations': self.extra['annotations'],
+            'annotations': extra['annotations'],
 
-            self.URL: self.record['url'],
-            self.SUMMARY: self.record['summary'],
-            self.NUMBER: self.record['number'],
-            self.COMPONENT: self.record['component'],
+            self.URL: record['url'],
+            self.SUMMARY: record['summary'],
+            self.NUMBER: record['number'],
+            self.COMPONENT: record['component'],
         }
 
     def get_default_description(self):
@@ -83,12 +94,6 @@ class TracIssue(Issue):
             cls='issue'
         )
 
-    def get_priority(self):
-        return self.PRIORITY_MAP.get(
-            self.record.get('priority'),
-            self.config.default_priority
-        )
-
 
 class TracService(Service):
     ISSUE_CLASS = TracIssue
@@ -99,28 +104,107 @@ class TracService(Service):
         if self.config.username:
             password = self.get_password('password', self.config.username)
 
-            auth = urllib.parse.quote_plus(
-                f'{self.config.username}:{password}@')
-        else:
-            auth = ''
-
-        self.trac = None
-        uri = f'{self.config.scheme}://{auth}{self.config.base_uri}/'
+        self._trac = None
         if self.config.no_xmlrpc:
-            self.uri = uri
+            self.uri = f'{self.config.scheme}://{self.config.base_uri}/'
+            self.session = requests.Session()
+            self.session.mount(self.uri, HTTPAdapter(
+                max_retries=Retry(total=3, backoff_factor=0.3)))
+            if self.config.username:
+                self.session.auth = (self.config.username, password)
         else:
-            self.trac = offtrac.TracServer(uri + 'login/xmlrpc')
+            auth = ''
+            if self.config.username:
+                # xmlrpc.client sends the user info of the url as basic auth.
+                username = urllib.parse.quote(self.config.username, safe='')
+                auth = f"{username}:{urllib.parse.quote(password, safe='')}@"
+            self._trac_uri = (
+                f'{self.config.scheme}://{auth}{self.config.base_uri}/'
+                'login/xmlrpc')
+
+    @property
+    def trac(self):
+        """ The XML-RPC server, only set up once it is first needed. """
+        if self._trac is None and not self.config.no_xmlrpc:
+            self._trac = offtrac.TracServer(self._trac_uri)
+        return self._trac
+
+    @trac.setter
+    def trac(self, trac):
+        self._trac = trac
 
     @staticmethod
     def get_keyring_service(config):
         return f"https://{config.username}@{config.base_uri}/"
 
-    def annotations(self, issue):
+    def get_cache_path(self, query):
+        """ Return the path of this target's cache of the tickets matching
+        `query`. Targets are pulled concurrently, so they never share one. """
+        digest = hashlib.blake2b(
+            f'{self.config.target}:{self.config.base_uri}?{query}'.encode(),
+            digest_size=16).hexdigest()
+        return config.get_cache_path(f'trac.{digest}')
+
+    def get_tickets(self, cache, query):
+        """ Return the tickets matching `query`.
+
+        The tickets are cached between pulls, only those which changed since
+        the last change seen, according to Trac's clock, are fetched again,
+        in a single XML-RPC multicall.
+        """
+        self.trac.setup_multicall()
+        self.trac.query_tickets(query)
+        if 'changetime' in cache:
+            self.trac.server.ticket.getRecentChanges(cache['changetime'])
+        numbers, *changed = self.trac.do_multicall()
+        changed = set(changed[0]) if changed else set()
+
+        keys = {str(number): number for number in numbers}
+        stale = [
+            number for key, number in keys.items()
+            if number in changed or key not in cache]
+        if stale:
+            self.trac.setup_multicall()
+            for number in stale:
+                self.trac.get_ticket(number)
+            for number, ticket in zip(stale, self.trac.do_multicall()):
+                cache[str(number)] = {'ticket': ticket}
+                if 'changetime' not in cache or ticket[2] > cache['changetime']:
+                    cache['changetime'] = ticket[2]
+
+        # Forget the tickets which were closed.
+        for key in set(cache) - set(keys) - {'changetime'}:
+            del cache[key]
+
+        return [cache[key]['ticket'] for key in keys]
+
+    def get_changelogs(self, cache, numbers):
+        """ Return the changelogs of tickets by number.
+
+        The changelogs are cached along with the tickets, and those which
+        are missing fetched in a single XML-RPC multicall. This is cheaper
+        than fetching them from a pool of threads, which would also need an
+        xmlrpc ServerProxy each as they are not thread-safe. Without XML-RPC
+        there are no changelogs to fetch.
+        """
+        missing = [
+            number for number in numbers
+            if 'changelog' not in cache[str(number)]]
+        if missing:
+            self.trac.setup_multicall()
+            for number in missing:
+                self.trac.server.ticket.changeLog(number)
+            for number, changelog in zip(missing, self.trac.do_multicall()):
+                entry = cache[str(number)]
+                entry['changelog'] = changelog
+                cache[str(number)] = entry
+        return {number: cache[str(number)]['changelog'] for number in numbers}
+
+    def annotations(self, issue, changelog):
         annotations = []
         # without offtrac, we can't get issue comments
-        if self.trac is None:
+        if self.config.no_xmlrpc:
             return annotations
-        changelog = self.trac.server.ticket.changeLog(issue['number'])
         for time, author, field, oldvalue, newvalue, permanent in changelog:
             if field == 'comment':
                 annotations.append((author, newvalue, ))
@@ -144,43 +228,87 @@ class TracService(Service):
 
         return True
 
+    def get_owners(self):
+        """ Return the owners to query tickets for, or None to query the
+        tickets of everyone.
+
+        Trac then only returns the tickets which :meth:`include` keeps.
+        """
+        if not self.config.only_if_assigned:
+            return None
+        owners = [self.config.only_if_assigned]
+        if self.config.also_unassigned:
+            owners.append('')  # the empty owner
+        return owners
+
+    def get_csv_tickets(self, base_url):
+        """ Yield the open tickets of the CSV report as they are received. """
+        params = {
+            'status': '!closed',
+            'max': '0',
+            'format': 'csv',
+            'col': ['id', 'summary', 'owner', 'priority', 'component'],
+        }
+        owners = self.get_owners()
+        if owners is not None:
+            # The query page takes each repeated argument as one value.
+            params['owner'] = owners
+        resp = self.session.get(self.uri + 'query', params=params, stream=True)
+        if resp.status_code != 200:
+            raise RuntimeError("Trac responded with %s" % resp)
+        # Let the csv module split the rows itself, as quoted fields may hold
+        # line breaks. utf-8-sig drops Trac's bogus BOM.
+        resp.raw.decode_content = True
+        # urllib3 would close the stream once exhausted, under the wrapper.
+        resp.raw.auto_close = False
+        lines = io.TextIOWrapper(resp.raw, encoding='utf-8-sig', newline='')
+        for ticket in csv.DictReader(lines):
+            ticket['url'] = f"{base_url}/ticket/{ticket['id']}"
+            ticket['number'] = int(ticket['id'])
+            yield self.config.target, ticket
+
     def issues(self):
-        base_url = "https://" + self.config.base_uri
-        if self.trac:
-            tickets = self.trac.query_tickets('status!=closed&max=0')
-            tickets = list(map(self.trac.get_ticket, tickets))
-            issues = [(self.config.target, ticket[3]) for ticket in tickets]
-            for i in range(len(issues)):
-                issues[i][1]['url'] = "%s/ticket/%i" % (base_url, tickets[i][0])
-                issues[i][1]['number'] = tickets[i][0]
+        base_url = f"{self.config.scheme}://{self.config.base_uri}"
+        changelogs = {}
+        if not self.config.no_xmlrpc:
+            query = 'status!=closed&max=0'
+            owners = self.get_owners()
+            if owners is not None:
+                # TracQuery strings separate alternative values with '|'.
+                query += '&owner=' + '|'.join(owners)
+            if self.config.ticket_cache:
+                cache_path = self.get_cache_path(query)
+                # The cache holds the tickets and comments of private trackers.
+                os.makedirs(
+                    os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+                cache = shelve.Shelf(dbm.open(cache_path, 'c', 0o600))
+            else:
+                cache = contextlib.nullcontext({})
+            with cache as cache:
+                issues = [
+                    (self.config.target, dict(
+                        attributes,
+                        url=f"{base_url}/ticket/{number}",
+                        number=number))
+                    for number, _, _, attributes in self.get_tickets(
+                        cache, query)]
+
+                log.debug(" Found %i total.", len(issues))
+
+                issues = list(filter(self.include, issues))
+                log.debug(" Pruned down to %i", len(issues))
+
+                changelogs = self.get_changelogs(
+                    cache, [issue['number'] for _, issue in issues])
         else:
-            resp = requests.get(
-                self.uri + 'query',
-                params={
-                    'status': '!closed',
-                    'max': '0',
-                    'format': 'csv',
-                    'col': ['id', 'summary', 'owner', 'priority', 'component'],
-                })
-            if resp.status_code != 200:
-                raise RuntimeError("Trac responded with %s" % resp)
-            # strip Trac's bogus BOM
-            text = resp.text[1:].lstrip('\ufeff')
-            tickets = list(csv.DictReader(StringIO.StringIO(text.encode('utf-8'))))
-            issues = [(self.config.target, ticket) for ticket in tickets]
-            for i in range(len(issues)):
-                issues[i][1]['url'] = "%s/ticket/%s" % (base_url, tickets[i]['id'])
-                issues[i][1]['number'] = int(tickets[i]['id'])
-
-        log.debug(" Found %i total.", len(issues))
-
-        issues = list(filter(self.include, issues))
-        log.debug(" Pruned down to %i", len(issues))
+            # Filter the tickets as they are received.
+            issues = filter(self.include, self.get_csv_tickets(base_url))
 
         for project, issue in issues:
             issue_obj = self.get_issue_for_record(issue)
             extra = {
-                'annotations': self.annotations(issue),
+                'annotations': self.annotations(
+                    issue, changelogs.get(issue['number'], [])),
                 'project': project,
             }
             issue_obj.extra.update(extra)
@@ -17,6 +17,7 @@ extras = {
     "jira": ["jira>=0.22"],
     "kanboard": ["kanboard"],
     "keyring": ["keyring"],
+    "orjson": ["orjson"],
     "phabricator": ["phabricator"],
     "test": [
         "docutils",
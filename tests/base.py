@@ -7,7 +7,7 @@ import unittest
 import pytest
 import responses
 
-from bugwarrior import config
+from bugwarrior import config, services
 from bugwarrior.config import schema
 
 
@@ -50,10 +50,14 @@ class ConfigTest(unittest.TestCase):
         # Configure environment.
         os.environ['HOME'] = self.tempdir
         os.environ['XDG_CONFIG_HOME'] = os.path.join(self.tempdir, '.config')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tempdir, '.cache')
         os.environ.pop(config.BUGWARRIORRC, None)
         os.environ.pop('TASKRC', None)
         os.environ.pop('XDG_CONFIG_DIRS', None)
 
+        # Forget the secrets resolved by previous tests.
+        services.Service._password_cache.clear()
+
     def tearDown(self):
         shutil.rmtree(self.tempdir, ignore_errors=True)
         os.environ = self.old_environ
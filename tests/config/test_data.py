@@ -34,6 +34,12 @@ class TestData(ConfigTest):
         self.assertEqual(self.data.get('key'), 'value')
         self.assert0600()
 
+    def test_get_missing(self):
+        self.assertIsNone(self.data.get('key'))
+
+        self.data.set('other', 'value')
+        self.assertIsNone(self.data.get('key'))
+
     def test_path_attribute(self):
         self.assertEqual(self.data.path, self.lists_path)
 
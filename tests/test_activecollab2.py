@@ -1,4 +1,3 @@
-import re
 import datetime
 
 import pytz
@@ -72,13 +71,22 @@ class TestActiveCollab2Issue(AbstractServiceTest, ServiceTest):
 
     @responses.activate
     def test_issues(self):
-        self.add_response(
-            re.compile(
-                r'http://hello/\?(?=.*token=howdy)(?=.*path_info=\%2Fprojects\%2F[1-2]\%2Fuser-tasks)(?=.*format=json)'),  # noqa: E501
-            json=[self.arbitrary_issue])
-        self.add_response(
-            re.compile(
-                r'http://hello/\?(?=.*token=howdy)(?=.*path_info=\%2Fprojects\%2F20\%2Ftickets\%2F10)(?=.*format=json)'),  # noqa: E501
+        for project_id in (1, 2):
+            responses.add(
+                responses.GET, 'http://hello/',
+                match=[responses.matchers.query_param_matcher({
+                    'token': 'howdy',
+                    'path_info': f'/projects/{project_id}/user-tasks',
+                    'format': 'json',
+                })],
+                json=[self.arbitrary_issue])
+        responses.add(
+            responses.GET, 'http://hello/',
+            match=[responses.matchers.query_param_matcher({
+                'token': 'howdy',
+                'path_info': '/projects/20/tickets/10',
+                'format': 'json',
+            })],
             json=self.arbitrary_issue)
 
         issue = next(self.service.issues())
@@ -1,3 +1,6 @@
+import json
+import threading
+
 import responses
 
 from bugwarrior.collect import TaskConstructor
@@ -6,6 +9,13 @@ from bugwarrior.services.bitbucket import BitbucketService
 from .base import ServiceTest, AbstractServiceTest
 
 
+API = 'https://api.bitbucket.org/2.0/repositories'
+REPO_QUERY = BitbucketService.REPO_FIELDS + '&pagelen=100&q=has_issues%3Dtrue'
+ISSUE_QUERY = BitbucketService.ISSUE_FIELDS
+PULL_REQUEST_QUERY = BitbucketService.PULL_REQUEST_FIELDS
+COMMENT_QUERY = BitbucketService.COMMENT_FIELDS
+
+
 class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
     SERVICE_CONFIG = {
         'service': 'bitbucket',
@@ -23,11 +33,70 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
             method='POST',
             json={
                 'access_token': 'sometoken',
-                'refresh_token': 'anothertoken'
+                'refresh_token': 'anothertoken',
+                'expires_in': 7200,
             }
         )
         self.service = self.get_mock_service(BitbucketService)
 
+    @responses.activate
+    def test_access_token_reused(self):
+        # No token request is mocked, so this would fail if one were made.
+        service = self.get_mock_service(BitbucketService)
+
+        self.assertEqual(
+            service.session.headers['Authorization'],
+            'Bearer sometoken')
+
+    @responses.activate
+    def test_access_token_expired(self):
+        self.service.main_config.data.set(
+            'bitbucket_access_token_expires_at', 0)
+        self.add_response(
+            'https://bitbucket.org/site/oauth2/access_token',
+            method='POST',
+            json={'access_token': 'newtoken', 'expires_in': 7200})
+
+        service = self.get_mock_service(BitbucketService)
+
+        self.assertEqual(
+            service.session.headers['Authorization'],
+            'Bearer newtoken')
+
+    @responses.activate
+    def test_access_token_from_older_data(self):
+        # Older releases only stored the refresh token.
+        with open(self.service.main_config.data._datafile, 'w') as f:
+            json.dump({'bitbucket_refresh_token': 'anothertoken'}, f)
+        self.add_response(
+            'https://bitbucket.org/site/oauth2/access_token',
+            method='POST',
+            json={'access_token': 'newtoken',
+                  'refresh_token': 'newrefreshtoken',
+                  'expires_in': 7200})
+
+        service = self.get_mock_service(BitbucketService)
+
+        self.assertEqual(
+            service.session.headers['Authorization'], 'Bearer newtoken')
+
+    @responses.activate
+    def test_access_token_new_consumer(self):
+        self.add_response(
+            'https://bitbucket.org/site/oauth2/access_token',
+            method='POST',
+            json={'access_token': 'newtoken',
+                  'refresh_token': 'newrefreshtoken',
+                  'expires_in': 7200})
+
+        service = self.get_mock_service(
+            BitbucketService, config_overrides={'secret': 'new secret'})
+
+        self.assertEqual(
+            service.session.headers['Authorization'], 'Bearer newtoken')
+        self.assertIn(
+            'grant_type=client_credentials', responses.calls[0].request.body)
+
     def test_to_taskwarrior(self):
         arbitrary_issue = {
             'priority': 'trivial',
@@ -62,14 +131,14 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
     @responses.activate
     def test_issues(self):
         self.add_response(
-            'https://api.bitbucket.org/2.0/repositories/somename/',
+            f'{API}/somename/?fields={REPO_QUERY}',
             json={'values': [{
                 'full_name': 'somename/somerepo',
                 'has_issues': True
             }]})
 
         self.add_response(
-            'https://api.bitbucket.org/2.0/repositories/somename/somerepo/issues/',
+            f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}',
             json={'values': [{
                 'title': 'Some Bug',
                 'status': 'open',
@@ -78,7 +147,7 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
             }]})
 
         self.add_response(
-            'https://api.bitbucket.org/2.0/repositories/somename/somerepo/pullrequests/',
+            f'{API}/somename/somerepo/pullrequests/?fields={PULL_REQUEST_QUERY}',
             json={'values': [{
                 'title': 'Some Feature',
                 'state': 'open',
@@ -87,7 +156,14 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
             }]})
 
         self.add_response(
-            'https://api.bitbucket.org/2.0/repositories/somename/somerepo/pullrequests/1/comments',
+            f'{API}/somename/somerepo/issues/1/comments?fields={COMMENT_QUERY}',
+            json={'values': [{
+                'user': {'username': 'somebody'},
+                'content': {'raw': 'Some issue comment.'}
+            }]})
+
+        self.add_response(
+            f'{API}/somename/somerepo/pullrequests/1/comments?fields={COMMENT_QUERY}',
             json={'values': [{
                 'user': {'username': 'nobody'},
                 'content': {'raw': 'Some comment.'}
@@ -96,7 +172,7 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
         issue, pr = (i for i in self.service.issues())
 
         expected_issue = {
-            'annotations': ['@nobody - Some comment.'],
+            'annotations': ['@somebody - Some issue comment.'],
             'bitbucketid': 1,
             'bitbuckettitle': 'Some Bug',
             'bitbucketurl': 'example.com',
@@ -119,6 +195,15 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
 
         self.assertEqual(TaskConstructor(pr).get_taskwarrior_record(), expected_pr)
 
+    def test_get_repository_query(self):
+        service = self.get_mock_service(
+            BitbucketService,
+            config_overrides={'include_repos': ['somerepo', 'otherrepo']})
+        self.assertEqual(
+            service.get_repository_query(),
+            'has_issues=true AND (full_name="somename/otherrepo" '
+            'OR full_name="somename/somerepo")')
+
     def test_get_owner(self):
         issue = {
             'title': 'Foobar',
@@ -136,7 +221,7 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
     @responses.activate
     def test_fetch_issues_pagination(self):
         self.add_response(
-            'https://api.bitbucket.org/2.0/repositories/somename/somerepo/issues/',
+            f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}',
             json={
                 'values': [{
                     'title': 'Some Bug',
@@ -144,10 +229,10 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
                     'links': {'html': {'href': 'example.com'}},
                     'id': 1
                 }],
-                'next': 'https://api.bitbucket.org/2.0/repositories/somename/somerepo/issues/?page=2',  # noqa: E501
+                'next': f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}&page=2',
             })
         self.add_response(
-            'https://api.bitbucket.org/2.0/repositories/somename/somerepo/issues/?page=2',
+            f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}&page=2',
             json={
                 'values': [{
                     'title': 'Some Other Bug',
@@ -172,3 +257,49 @@ class TestBitbucketIssue(AbstractServiceTest, ServiceTest):
             }),
         ]
         self.assertEqual(issues, expected)
+
+    @responses.activate
+    def test_fetch_issues_pagination_with_size(self):
+        self.add_response(
+            f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}',
+            json={
+                'values': [{'title': 'Some Bug', 'id': 1}],
+                'size': 3,
+                'pagelen': 1,
+                'next': f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}&page=2',
+            })
+        self.add_response(
+            f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}&page=2',
+            json={'values': [{'title': 'Some Other Bug', 'id': 2}]})
+        self.add_response(
+            f'{API}/somename/somerepo/issues/?fields={ISSUE_QUERY}&page=3',
+            json={'values': [{'title': 'Yet Another Bug', 'id': 3}]})
+        issues = list(self.service.fetch_issues('somename/somerepo'))
+        self.assertEqual([issue['id'] for _, issue in issues], [1, 2, 3])
+
+    @responses.activate
+    def test_get_data_bounded(self):
+        """ Requests take one of the slots shared by all fetching threads. """
+        self.service.request_slots = threading.BoundedSemaphore(1)
+
+        def callback(request):
+            self.assertFalse(
+                self.service.request_slots.acquire(blocking=False))
+            return 200, {}, '{"values": []}'
+
+        responses.add_callback(
+            responses.GET, f'{API}/somename/somerepo/issues/',
+            callback=callback)
+        self.assertEqual(
+            self.service.get_data(f'{API}/somename/somerepo/issues/'),
+            {'values': []})
+        self.assertTrue(self.service.request_slots.acquire(blocking=False))
+
+    def test_filter_issues(self):
+        issues = [
+            [('somename/somerepo', {'id': 1, 'state': 'open'}),
+             ('somename/somerepo', {'id': 2, 'state': 'resolved'})],
+            [('somename/otherrepo', {'id': 3, 'state': 'new'})],
+        ]
+        filtered = self.service.filter_issues(issues, frozenset(['resolved']))
+        self.assertEqual([issue['id'] for _, issue in filtered], [1, 3])
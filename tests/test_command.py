@@ -1,6 +1,8 @@
+import fcntl
 import os
 import logging
 import pathlib
+import types
 from unittest import mock, TestCase
 
 from click.testing import CliRunner
@@ -33,7 +35,7 @@ def fake_bz_issues(self):
         })]
 
 
-class TestPull(ConfigTest):
+class CliTest(ConfigTest):
 
     def setUp(self):
         super().setUp()
@@ -66,6 +68,9 @@ class TestPull(ConfigTest):
             conf.write(configfile)
         return rcfile
 
+
+class TestPull(CliTest):
+
     @mock.patch(
         'bugwarrior.services.github.GithubService.issues', fake_github_issues)
     def test_success(self):
@@ -189,6 +194,83 @@ class TestPull(ConfigTest):
         self.assertIn('Updating 0 tasks', logs)
         self.assertIn('Closing 0 tasks', logs)
 
+    @mock.patch(
+        'bugwarrior.services.github.GithubService.issues', fake_github_issues)
+    def test_locked(self):
+        """
+        Another bugwarrior process holds the lock.
+        """
+        lockfile_path = os.path.join(self.lists_path, 'bugwarrior.lockfile')
+        with open(lockfile_path, 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            with self.caplog.at_level(logging.INFO):
+                result = self.runner.invoke(
+                    command.cli, args=('pull', '--debug'))
+
+        logs = [rec.message for rec in self.caplog.records]
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn(
+            'Your taskrc repository is currently locked by another '
+            f'bugwarrior process (see the pid in {lockfile_path}).', logs)
+        self.assertNotIn('Adding 1 tasks', logs)
+
+    @mock.patch('bugwarrior.command.fcntl', None)
+    def test_lock_without_fcntl(self):
+        """
+        Without fcntl, e.g. on Windows, a pid lock file is used instead.
+        """
+        lockfile_path = os.path.join(self.lists_path, 'bugwarrior.lockfile')
+        with command._pull_lock(lockfile_path):
+            with open(lockfile_path) as lockfile:
+                self.assertEqual(int(lockfile.read()), os.getpid())
+        self.assertFalse(os.path.exists(lockfile_path))
+
+
+class TestUda(CliTest):
+
+    def test_cached(self):
+        first = self.runner.invoke(command.cli, args=('uda',))
+        self.assertEqual(first.exit_code, 0)
+        self.assertIn('uda.githubtitle.type=string\n', first.stdout)
+
+        with mock.patch('bugwarrior.db.get_defined_udas_as_strings',
+                        side_effect=AssertionError('udas were not cached')):
+            second = self.runner.invoke(command.cli, args=('uda',))
+
+        self.assertEqual(second.exit_code, 0)
+        self.assertEqual(second.stdout, first.stdout)
+
+    def test_cache_invalidated_by_service_upgrade(self):
+        self.runner.invoke(command.cli, args=('uda',))
+
+        plugin = types.SimpleNamespace(
+            dist=types.SimpleNamespace(name='bugwarrior-plugin', version='2'))
+        with mock.patch('importlib_metadata.entry_points',
+                        return_value=[plugin]), \
+                mock.patch('bugwarrior.db.get_defined_udas_as_strings',
+                           return_value=['uda.plugintitle.type=string']):
+            result = self.runner.invoke(command.cli, args=('uda',))
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('uda.plugintitle.type=string\n', result.stdout)
+
+
+class TestVault(CliTest):
+
+    def test_list(self):
+        self.config['my_service']['github.token'] = '@oracle:use_keyring'
+        self.write_rc(self.config)
+
+        result = self.runner.invoke(command.cli, args=('vault', 'list'))
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(
+            result.stdout,
+            '1 @oracle:use_keyring passwords in bugwarriorrc\n'
+            '- github://ralphbean@github.com/ralphbean\n')
+
 
 class TestIni2Toml(TestCase):
     def setUp(self):
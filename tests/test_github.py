@@ -1,12 +1,16 @@
 import datetime
-from unittest import TestCase
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
 
 import pytz
 import responses
 
 from bugwarrior.collect import TaskConstructor
 from bugwarrior.services.github import (
-    GithubConfig, GithubService, GithubClient)
+    EtagCache, GithubConfig, GithubService, GithubClient)
 
 from .base import ServiceTest, AbstractServiceTest
 
@@ -44,6 +48,47 @@ ARBITRARY_EXTRA = {
 }
 
 
+def graphql_issue(number, **fields):
+    """ Return an issue or pull request node as found in GraphQL responses. """
+    return {
+        'number': number,
+        'title': 'Hallo',
+        'body': 'Something',
+        'url': f'https://github.com/arbitrary_username/arbitrary_repo/issues/{number}',
+        'createdAt': ARBITRARY_CREATED.isoformat(),
+        'updatedAt': ARBITRARY_UPDATED.isoformat(),
+        'closedAt': None,
+        'state': 'OPEN',
+        'author': {'login': 'arbitrary_login'},
+        'milestone': None,
+        'labels': {
+            'pageInfo': {'hasNextPage': False},
+            'nodes': [{'name': 'bugfix'}],
+        },
+        'assignees': {'nodes': []},
+        **fields,
+    }
+
+
+def graphql_repositories(*repositories):
+    """ Return the GraphQL response listing the user's `repositories`, given
+    as (name, issues, pull requests, whether issues have a next page). """
+    return {'data': {'repositoryOwner': {'repositories': {
+        'pageInfo': {'endCursor': 'abc', 'hasNextPage': False},
+        'nodes': [{
+            'name': name,
+            'issues': {
+                'pageInfo': {'hasNextPage': more_issues},
+                'nodes': issues,
+            },
+            'pullRequests': {
+                'pageInfo': {'hasNextPage': False},
+                'nodes': pull_requests,
+            },
+        } for name, issues, pull_requests, more_issues in repositories],
+    }}}}
+
+
 class TestGithubIssue(AbstractServiceTest, ServiceTest):
     maxDiff = None
     SERVICE_CONFIG = {
@@ -181,6 +226,119 @@ class TestGithubIssue(AbstractServiceTest, ServiceTest):
 
         self.assertEqual(TaskConstructor(issue).get_taskwarrior_record(), expected)
 
+    @responses.activate
+    def test_issues_graphql(self):
+        self.add_response(
+            'https://api.github.com/graphql',
+            method='POST',
+            json=graphql_repositories(
+                ('arbitrary_repo',
+                 [graphql_issue(4)], [graphql_issue(5, isDraft=True)], False),
+                ('busy_repo', [graphql_issue(3)], [], True)))
+
+        self.add_response(
+            'https://api.github.com/repos/arbitrary_username/busy_repo/issues?per_page=100',
+            json=[ARBITRARY_ISSUE])
+
+        self.add_response(
+            'https://api.github.com/issues?per_page=100',
+            json=[])
+
+        service = self.get_mock_service(
+            GithubService,
+            config_overrides={
+                'use_graphql': True, 'import_labels_as_tags': True},
+            general_overrides={'annotation_comments': False})
+        issues = {issue.record['number']: issue for issue in service.issues()}
+
+        self.assertEqual(sorted(issues), [4, 5, 10])
+        self.assertEqual(issues[10].record['repo'], 'arbitrary_username/busy_repo')
+
+        pull_request = TaskConstructor(issues[5]).get_taskwarrior_record()
+        self.assertEqual(pull_request['githubtype'], 'pull_request')
+        self.assertEqual(pull_request['githubdraft'], 1)
+        self.assertEqual(pull_request['githubstate'], 'open')
+        self.assertEqual(pull_request['githubuser'], 'arbitrary_login')
+        self.assertEqual(pull_request['githubmilestone'], None)
+        self.assertEqual(pull_request['tags'], ['bugfix'])
+        self.assertEqual(
+            pull_request['githuburl'],
+            'https://github.com/arbitrary_username/arbitrary_repo/issues/5')
+
+    @responses.activate
+    def test_issues_graphql_many_labels(self):
+        labelled = graphql_issue(4, labels={
+            'pageInfo': {'hasNextPage': True},
+            'nodes': [{'name': f'label{i}'} for i in range(20)],
+        })
+        self.add_response(
+            'https://api.github.com/graphql',
+            method='POST',
+            json=graphql_repositories(
+                ('arbitrary_repo', [labelled], [], False)))
+
+        # The labels which did not fit are fetched through the REST API.
+        self.add_response(
+            'https://api.github.com/repos/arbitrary_username/arbitrary_repo/issues?per_page=100',
+            json=[ARBITRARY_ISSUE])
+
+        self.add_response(
+            'https://api.github.com/issues?per_page=100',
+            json=[])
+
+        service = self.get_mock_service(
+            GithubService,
+            config_overrides={'use_graphql': True},
+            general_overrides={'annotation_comments': False})
+
+        self.assertEqual(
+            [issue.record['number'] for issue in service.issues()], [10])
+
+    @responses.activate
+    def test_issues_graphql_comments(self):
+        preloaded = graphql_issue(4, comments={
+            'pageInfo': {'hasNextPage': False},
+            'nodes': [{
+                'author': {'login': 'arbitrary_login'},
+                'body': 'Preloaded comment.',
+            }],
+        })
+        truncated = graphql_issue(5, isDraft=False, comments={
+            'pageInfo': {'hasNextPage': True},
+            'nodes': [],
+        })
+        self.add_response(
+            'https://api.github.com/graphql',
+            method='POST',
+            json=graphql_repositories(
+                ('arbitrary_repo', [preloaded], [truncated], False)))
+
+        self.add_response(
+            'https://api.github.com/issues?per_page=100',
+            json=[])
+
+        # Only the pull request has too many comments to be preloaded.
+        self.add_response(
+            'https://api.github.com/repos/arbitrary_username/arbitrary_repo/issues/5/comments?per_page=100',  # noqa: E501
+            json=[{
+                'user': {'login': 'arbitrary_login'},
+                'body': 'Arbitrary comment.'
+            }])
+
+        service = self.get_mock_service(
+            GithubService, config_overrides={'use_graphql': True})
+        issues = {issue.record['number']: issue for issue in service.issues()}
+
+        self.assertEqual(
+            json.loads(responses.calls[0].request.body)['variables']['comments'],
+            True)
+        self.assertEqual(
+            issues[4].extra['annotations'],
+            ['@arbitrary_login - Preloaded comment.'])
+        self.assertEqual(
+            issues[5].extra['annotations'],
+            ['@arbitrary_login - Arbitrary comment.'])
+
 
 class TestGithubIssueQuery(AbstractServiceTest, ServiceTest):
     maxDiff = None
@@ -258,6 +416,43 @@ class TestGithubService(ServiceTest):
         self.assertEqual(service.client.session.headers['Authorization'],
                          "token 1234567890ABCDEF")
 
+    def test_extra_tokens_oracle(self):
+        self.config = {
+            'general': {'targets': ['mygithub']},
+            'mygithub': {
+                **self.SERVICE_CONFIG,
+                'extra_tokens': '@oracle:eval:echo abcd, @oracle:use_keyring',
+            },
+        }
+        self.assertValidationError(
+            '@oracle:use_keyring is not supported, extra tokens may only be '
+            'given in plain text or through @oracle:eval:')
+
+    def test_issue_urls_inconsistent_host(self):
+        self.config = {
+            'general': {'targets': ['mygithub']},
+            'mygithub': {
+                **self.SERVICE_CONFIG,
+                'issue_urls': 'https://example.com/octo/repo/issues/1',
+            },
+        }
+        self.assertValidationError(
+            '[mygithub]\nissue_urls  <- '
+            'https://example.com/octo/repo/issues/1 inconsistent with host '
+            'github.com')
+
+    def test_issue_urls_invalid_path(self):
+        self.config = {
+            'general': {'targets': ['mygithub']},
+            'mygithub': {
+                **self.SERVICE_CONFIG,
+                'issue_urls': 'https://github.com/octo/repo/wiki/1',
+            },
+        }
+        self.assertValidationError(
+            '[mygithub]\nissue_urls  <- '
+            '/octo/repo/wiki/1 is not a valid issue path')
+
     def test_default_host(self):
         """ Check that if host is not set, we default to github.com """
         service = self.get_mock_service(GithubService)
@@ -323,6 +518,16 @@ class TestGithubClient(TestCase):
         self.assertEqual(
             client._api_url('/some/path'), 'https://api.github.com/some/path')
 
+    @responses.activate
+    def test_user_repos_issues_unknown_owner(self):
+        responses.add(
+            responses.POST, 'https://api.github.com/graphql',
+            json={'data': {'repositoryOwner': None}})
+        client = GithubClient('github.com', {'token': 'xxxx'})
+
+        with self.assertRaises(OSError):
+            list(client.get_user_repos_issues('nobody'))
+
     def test_api_url_with_context(self):
         auth = {'token': 'xxxx'}
         client = GithubClient('github.com', auth)
@@ -337,3 +542,68 @@ class TestGithubClient(TestCase):
         self.assertEqual(
             client._api_url('/some/path'),
             'https://github.example.com/api/v3/some/path')
+
+    def test_link_field_to_dict(self):
+        field = (
+            '<https://api.github.com/issues?per_page=100&page=2>; rel="next", '
+            '<https://api.github.com/issues?per_page=100&page=5>; rel="last"')
+        self.assertEqual(GithubClient._link_field_to_dict(field), {
+            'next': 'https://api.github.com/issues?per_page=100&page=2',
+            'last': 'https://api.github.com/issues?per_page=100&page=5',
+        })
+        self.assertEqual(GithubClient._link_field_to_dict(None), {})
+
+    @responses.activate
+    def test_extra_tokens(self):
+        auth = {'token': 'aaaa', 'extra_tokens': ['bbbb']}
+        client = GithubClient('github.com', auth)
+        url = 'https://api.github.com/issues?per_page=100'
+        responses.add(
+            responses.GET, url, json=[],
+            headers={'X-RateLimit-Remaining': '0',
+                     'X-RateLimit-Reset': str(int(time.time()) + 3600)})
+        responses.add(responses.GET, url, json=[])
+
+        list(client.get_directly_assigned_issues())
+        list(client.get_directly_assigned_issues())
+
+        first, second = (
+            call.request.headers['Authorization'] for call in responses.calls)
+        self.assertEqual({first, second}, {'token aaaa', 'token bbbb'})
+
+    @responses.activate
+    def test_etag_cache(self):
+        url = 'https://api.github.com/issues?per_page=100'
+        responses.add(
+            responses.GET, url, json=[ARBITRARY_ISSUE],
+            headers={'ETag': '"abc"'})
+        responses.add(responses.GET, url, status=304)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            etag_cache = EtagCache(os.path.join(tempdir, 'etags.db'))
+            client = GithubClient('github.com', {'token': 'xxxx'}, etag_cache)
+
+            self.assertEqual(
+                list(client.get_directly_assigned_issues()),
+                [ARBITRARY_ISSUE])
+            self.assertEqual(
+                list(client.get_directly_assigned_issues()),
+                [ARBITRARY_ISSUE])
+
+        self.assertNotIn('If-None-Match', responses.calls[0].request.headers)
+        self.assertEqual(
+            responses.calls[1].request.headers['If-None-Match'], '"abc"')
+
+    def test_etag_cache_expiry(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'bugwarrior', 'etags.db')
+            EtagCache(path).set('https://example.com', '"abc"', b'[]', None)
+            self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777,
+                             0o700)
+
+            self.assertEqual(
+                EtagCache(path).get('https://example.com'),
+                ('"abc"', b'[]', None))
+
+            with mock.patch.object(EtagCache, 'MAX_AGE', -1):
+                self.assertIsNone(EtagCache(path).get('https://example.com'))
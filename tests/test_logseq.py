@@ -1,3 +1,4 @@
+from datetime import datetime
 from unittest import mock
 
 from bugwarrior.collect import TaskConstructor
@@ -100,3 +101,17 @@ class TestLogseqIssue(AbstractServiceTest, ServiceTest):
         }
 
         self.assertEqual(TaskConstructor(issue).get_taskwarrior_record(), expected)
+
+    def test_get_scheduled_date(self):
+        issue = self.service.get_issue_for_record(self.test_record, self.test_extra)
+
+        for line, expected in (
+            ("SCHEDULED: <2024-06-20 Thu>", datetime(2024, 6, 20)),
+            ("SCHEDULED: <2024-06-20 Thu .+1d>", datetime(2024, 6, 20)),
+            ("DEADLINE: <2024-06-20 Thu 10:55>", datetime(2024, 6, 20, 10, 55)),
+            ("DEADLINE: <2024-06-20 Thu 10:55 .+1d>", datetime(2024, 6, 20, 10, 55)),
+            ("SCHEDULED: <2024-06-20>", None),
+            ("SCHEDULED: <2024-13-20 Thu>", None),
+        ):
+            with self.subTest(line=line):
+                self.assertEqual(issue.get_scheduled_date(line), expected)
@@ -19,6 +19,7 @@ class DumbConfig(config.ServiceConfig):
 
     import_labels_as_tags: bool = False
     label_template: str = '{{label}}'
+    password: str = ''
 
 
 class DumbIssue(services.Issue):
@@ -60,7 +61,7 @@ class ServiceBase(ConfigTest):
         }
 
     def makeService(self):
-        with unittest.mock.patch('bugwarrior.config.schema.get_service',
+        with unittest.mock.patch('bugwarrior.collect.get_service',
                                  lambda x: DumbService):
             conf = schema.validate_config(self.config, 'general', 'configpath')
         return DumbService(conf['test'], conf['general'])
@@ -121,6 +122,22 @@ class TestService(ServiceBase):
         self.assertEqual(annotations, [
             f'@some_author - {LONG_MESSAGE}'])
 
+    @unittest.mock.patch.object(
+        DumbService, 'get_keyring_service',
+        staticmethod(lambda config: 'test://keyring'))
+    @unittest.mock.patch('bugwarrior.config.secrets.get_service_password',
+                         return_value='s3cret')
+    def test_get_password_cached(self, get_service_password):
+        self.config['test']['password'] = '@oracle:use_keyring'
+
+        self.assertEqual(
+            self.makeService().get_password('password', 'me'), 's3cret')
+        self.assertEqual(
+            self.makeService().get_password('password', 'me'), 's3cret')
+        get_service_password.assert_called_once_with(
+            'test://keyring', 'me', oracle='@oracle:use_keyring',
+            interactive=False)
+
 
 class TestIssue(ServiceBase):
 
@@ -156,3 +173,11 @@ class TestIssue(ServiceBase):
 
         self.assertEqual(issue.get_tags_from_labels(['needs work']),
                          ['needs_work'])
+
+    def test_get_tags_from_labels_template(self):
+        self.config['test']['import_labels_as_tags'] = True
+        self.config['test']['label_template'] = 'label_{{label}}'
+        issue = self.makeIssue()
+
+        self.assertEqual(issue.get_tags_from_labels(['needs work']),
+                         ['label_needs_work'])